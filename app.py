@@ -1,79 +1,246 @@
 import streamlit as st
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import codecs
+import os
+import re
+import time
+from pathlib import Path
+import joblib
+import aiohttp
+import xxhash
+from selectolax.lexbor import LexborHTMLParser
 from readability import Document
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import difflib
-import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 import pandas as pd
-import xml.etree.ElementTree as ET
+from lxml import etree
 import io
+import xlsxwriter
 from collections import defaultdict
+from pair_diff import SHINGLE_SIZE, build_shingles, process_pair
 from sklearn.feature_extraction.text import CountVectorizer
 
+# --- HTTP Session ---
+USER_AGENT = "DupChecker/1.0"
+
+def client_session():
+    connector = aiohttp.TCPConnector(limit=20, ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT})
+
 # --- Helper Functions ---
-def clean_text(html):
+_LOWER_TABLE = bytes.maketrans(bytes(range(65, 91)), bytes(range(97, 123)))
+# Encodings where bytes 0x41-0x5A only ever mean A-Z. In multi-byte encodings such as
+# Shift_JIS, GBK or Big5 they also occur as trail bytes, so those pages are never translated.
+_BYTE_LOWER_SAFE_CODECS = ({"ascii", "utf-8", "koi8-r", "koi8-u"}
+                           | {f"iso8859-{n}" for n in range(1, 17)}
+                           | {f"cp{n}" for n in range(1250, 1259)})
+
+# Character references whose meaning depends on case: named entities with a capital
+# (&Dagger; is not &dagger;) and numeric references to A-Z (&#65;, &#x5A;), which the
+# isascii() shortcut in clean_text would otherwise leave uppercase.
+_CASE_SENSITIVE_REF = re.compile(rb"&(?:[A-Za-z0-9]*[A-Z]"
+                                 rb"|#0*(?:6[5-9]|[78][0-9]|90)\b"
+                                 rb"|#[xX]0*(?:4[1-9a-fA-F]|5[0-9aA])\b)")
+
+def can_lower_bytes(charset, body):
+    try:
+        if not charset or codecs.lookup(charset).name not in _BYTE_LOWER_SAFE_CODECS:
+            return False
+    except LookupError:
+        return False
+    return _CASE_SENSITIVE_REF.search(body) is None
+
+def clean_text(html, ascii_lowered=False):
+    # When ascii_lowered, A-Z were already lowercased on the raw bytes in fetch_contents
+    # (never done for pages with case-sensitive character references, see can_lower_bytes),
+    # so only pages with non-ASCII text still need a full str.lower().
     doc = Document(html)
     summary = doc.summary()
-    soup = BeautifulSoup(summary, "html.parser")
-    text = soup.get_text(separator=' ', strip=True)
-    return re.sub(r'\s+', ' ', text.lower())
+    text = LexborHTMLParser(summary).text(separator=' ', strip=True)
+    if not ascii_lowered or not text.isascii():
+        text = text.lower()
+    return " ".join(text.split())
 
-def fetch_content(url):
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            return clean_text(response.text)
-        else:
-            return f"Error: {response.status_code}"
-    except Exception as e:
-        return f"Error: {e}"
+# CMS templates often serve byte-identical pages, so memoize cleaning by a content hash.
+# The leading underscore tells Streamlit not to hash the (large) HTML argument itself.
+@st.cache_data(max_entries=256, show_spinner=False)
+def _clean_by_hash(digest, charset, ascii_lowered, _html):
+    return clean_text(_html, ascii_lowered=ascii_lowered)
+
+def decode_page(body, charset):
+    # Use the Content-Type charset when there is one so readability doesn't have to guess it
+    # with chardet; otherwise hand it the bytes and let it read the <meta> declaration.
+    if charset:
+        try:
+            return body.decode(charset, errors='replace')
+        except LookupError:
+            pass
+    return body
+
+async def fetch_async(session, url):
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+        if response.status != 200:
+            raise ValueError(response.status)
+        return await response.read(), response.charset
+
+async def fetch_all(urls):
+    async with client_session() as session:
+        tasks = [fetch_async(session, url) for url in urls]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+PAGE_CACHE_TTL = 3600
+
+@st.cache_resource
+def _page_cache():
+    # Cleaned text by URL, shared across reruns; only successful fetches are stored.
+    return {}
+
+def fetch_contents(urls):
+    cache = _page_cache()
+    now = time.monotonic()
+    for url, (fetched_at, _) in list(cache.items()):
+        if now - fetched_at >= PAGE_CACHE_TTL:
+            cache.pop(url, None)
+
+    texts = {}
+    for url in urls:
+        entry = cache.get(url)
+        if entry is not None:
+            texts[url] = entry[1]
+    missing = list(dict.fromkeys(url for url in urls if url not in texts))
+    if missing:
+        raw = asyncio.run(fetch_all(missing))
+        for url, page in zip(missing, raw):
+            if isinstance(page, Exception):
+                texts[url] = f"Error: {str(page) or type(page).__name__}"
+                continue
+            try:
+                body, charset = page
+                ascii_lowered = can_lower_bytes(charset, body)
+                if ascii_lowered:
+                    body = body.translate(_LOWER_TABLE)
+                html = decode_page(body, charset)
+                texts[url] = _clean_by_hash(xxhash.xxh3_64_intdigest(body), charset, ascii_lowered, html)
+            except Exception as e:
+                texts[url] = f"Error: {e}"
+                continue
+            cache[url] = (now, texts[url])
+    return [texts[url] for url in urls]
+
+# Similarity matrices are also kept on disk so identical corpora are not re-vectorized after an
+# app restart. The store holds at most SIMILARITY_CACHE_MAX_FILES entries, least recently used
+# evicted first (st.cache_data's persist="disk" has no TTL and never prunes its files).
+SIMILARITY_CACHE_DIR = Path(".cache") / "similarity"
+SIMILARITY_CACHE_MAX_FILES = 64
+
+def _similarity_cache_path(texts):
+    digest = xxhash.xxh3_128()
+    for text in texts:
+        data = text.encode()
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data)
+    return SIMILARITY_CACHE_DIR / f"{digest.hexdigest()}.joblib"
 
+def _prune_similarity_cache():
+    files = sorted(SIMILARITY_CACHE_DIR.glob("*.joblib"), key=lambda f: f.stat().st_mtime, reverse=True)
+    for stale in files[SIMILARITY_CACHE_MAX_FILES:]:
+        stale.unlink(missing_ok=True)
+
+@st.cache_data(max_entries=32, show_spinner=False)
 def compare_texts(texts):
-    vectorizer = TfidfVectorizer(stop_words='english')
+    path = _similarity_cache_path(texts)
+    try:
+        similarity = joblib.load(path)
+        os.utime(path)
+        return similarity
+    except Exception:
+        pass
+
+    vectorizer = TfidfVectorizer(stop_words='english', dtype=np.float32, sublinear_tf=True,
+                                 norm='l2', max_features=50000, ngram_range=(1, 1))
     tfidf_matrix = vectorizer.fit_transform(texts)
-    similarity = cosine_similarity(tfidf_matrix)
+    # Rows are already L2-normalized, so the dot product is the cosine similarity.
+    similarity = (tfidf_matrix @ tfidf_matrix.T).toarray()
+    try:
+        SIMILARITY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        joblib.dump(similarity, path)
+        _prune_similarity_cache()
+    except OSError:
+        pass
     return similarity
 
-def highlight_diff(text1, text2):
-    d = difflib.HtmlDiff(wrapcolumn=80)
-    html_table = d.make_table(text1.split(), text2.split(), context=True, numlines=2)
-    styled_html = f"""
-    <style>
-    table {{
-        width: 100%;
-        border-collapse: collapse;
-        font-family: Arial, sans-serif;
-        font-size: 14px;
-    }}
-    th, td {{
-        padding: 8px;
-        text-align: left;
-        border: 1px solid #ccc;
-        white-space: pre-wrap;
-        word-wrap: break-word;
-    }}
-    tr:nth-child(even) {{
-        background-color: #f9f9f9;
-    }}
-    .diff_add {{ background-color: #d4f7dc; }}
-    .diff_chg {{ background-color: #fff3cd; }}
-    .diff_sub {{ background-color: #f8d7da; }}
-    </style>
-    {html_table}
-    """
-    return styled_html
+MAX_CHILD_SITEMAPS = 20
+SITEMAP_RETRIES = 2
+SITEMAP_BACKOFF = 0.3
+
+async def read_sitemap_locs(session, sitemap_url, limit):
+    async with session.get(sitemap_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+        if response.status != 200:
+            raise ValueError(response.status)
+        parser = etree.XMLPullParser(events=('start', 'end'), recover=True, huge_tree=False)
+        is_index = None
+        locs = []
+        # Stream <loc> elements so large sitemaps stop downloading once `limit` is reached.
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if is_index is None and event == 'start':
+                    is_index = etree.QName(elem).localname == 'sitemapindex'
+                elif event == 'end' and etree.QName(elem).localname == 'loc':
+                    if elem.text:
+                        locs.append(elem.text.strip())
+                    elem.clear()
+            if len(locs) >= (MAX_CHILD_SITEMAPS if is_index else limit):
+                break
+    return is_index, locs
+
+async def extract_urls_from_sitemap_async(session, sitemap_url, limit, depth=0):
+    # Retry connection and read failures with exponential backoff, like urllib3's Retry.
+    for attempt in range(SITEMAP_RETRIES + 1):
+        try:
+            is_index, locs = await read_sitemap_locs(session, sitemap_url, limit)
+            break
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == SITEMAP_RETRIES:
+                raise
+            await asyncio.sleep(SITEMAP_BACKOFF * 2 ** attempt)
+
+    if not is_index:
+        return locs[:limit]
+    # The sitemap protocol does not allow indexes to nest, so never follow one from a child;
+    # this also stops an index that lists itself.
+    if depth > 0:
+        return []
+
+    # Sitemap index: fetch child sitemaps in parallel batches until enough URLs are collected.
+    child_sitemaps = [url for url in dict.fromkeys(locs) if url != sitemap_url][:MAX_CHILD_SITEMAPS]
+    urls = []
+    for start in range(0, len(child_sitemaps), limit):
+        batch = child_sitemaps[start:start + limit]
+        children = await asyncio.gather(*[extract_urls_from_sitemap_async(session, url, limit, depth + 1)
+                                          for url in batch],
+                                        return_exceptions=True)
+        urls.extend(url for child in children if not isinstance(child, Exception) for url in child)
+        if len(urls) >= limit:
+            break
+    return urls[:limit]
+
+async def _extract_urls_from_sitemap(sitemap_url, limit):
+    async with client_session() as session:
+        return await extract_urls_from_sitemap_async(session, sitemap_url, limit)
+
+# Cached so reruns (e.g. dragging the threshold slider) don't refetch the sitemap and its
+# children. Failures raise inside the cached function, so they are not stored.
+@st.cache_data(ttl=PAGE_CACHE_TTL, show_spinner=False)
+def _cached_sitemap_urls(sitemap_url, limit):
+    return asyncio.run(_extract_urls_from_sitemap(sitemap_url, limit))
 
 def extract_urls_from_sitemap(sitemap_url, limit=5):
     try:
-        response = requests.get(sitemap_url, timeout=10)
-        if response.status_code == 200:
-            tree = ET.fromstring(response.content)
-            urls = [elem.text for elem in tree.iter() if 'loc' in elem.tag]
-            return urls[:limit]
-        else:
-            return []
+        return _cached_sitemap_urls(sitemap_url, limit)
     except Exception as e:
         return []
 
@@ -86,6 +253,22 @@ def detect_keyword_cannibalization(texts, urls, top_n=10):
     cannibalization = keyword_df[(keyword_df > 0).sum(axis=1) > 1]
     return cannibalization.sort_values(by=list(cannibalization.columns), ascending=False).head(top_n)
 
+@st.cache_resource
+def _pair_pool():
+    # "spawn" avoids forking Streamlit's multi-threaded server. Each worker still re-imports the
+    # launcher as __mp_main__ (so Streamlit too) once, which is why the pool is kept across reruns.
+    return ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+
+def run_pair_jobs(jobs):
+    # difflib is pure Python and CPU-bound, so spread the pairs across processes.
+    if len(jobs) <= 1:
+        return [process_pair(job) for job in jobs]
+    try:
+        return list(_pair_pool().map(process_pair, jobs))
+    except BrokenProcessPool:
+        _pair_pool.clear()
+        return [process_pair(job) for job in jobs]
+
 # --- Streamlit App ---
 st.set_page_config(page_title="Duplicate Content Checker", layout="wide")
 st.sidebar.title("🔍 Duplicate Content Checker")
@@ -106,12 +289,19 @@ if page == "Input & Analysis":
         url_inputs = [st.text_input(f"URL {i+1}") for i in range(5)]
         urls = [url for url in url_inputs if url]
 
+    threshold = st.slider("Similarity threshold", min_value=0.0, max_value=1.0, value=0.5, step=0.05,
+                          help="Highlighted phrases and diffs are only computed for page pairs scoring at or above this value.")
+    with st.expander("Duplicate phrase settings"):
+        min_words = st.number_input("Minimum shared words", min_value=2, max_value=50, value=SHINGLE_SIZE,
+                                    help="Shortest run of identical words reported as a duplicate phrase.")
+        min_chars = st.number_input("Minimum phrase length (characters)", min_value=0, max_value=1000, value=50)
+
     if st.button("Compare Content"):
         if len(urls) < 2:
             st.warning("Please enter at least two URLs.")
         else:
             with st.spinner("Fetching and comparing content..."):
-                texts = [fetch_content(url) for url in urls]
+                texts = fetch_contents(urls)
                 similarity_matrix = compare_texts(texts)
                 df = pd.DataFrame(similarity_matrix, index=urls, columns=urls)
 
@@ -119,23 +309,29 @@ if page == "Input & Analysis":
             st.dataframe(df.style.background_gradient(cmap='YlOrRd'))
 
             st.session_state['comparison_results'] = []
+            iu = np.triu_indices(len(urls), k=1)
+            scores = similarity_matrix[iu]
+            similar = scores >= threshold
+            pairs = list(zip(iu[0][similar], iu[1][similar]))
+
+            # Tokenize and shingle each text once; jobs reference these per pair.
+            tokens = [text.split() for text in texts]
+            shingles = [build_shingles(words, size=min_words) for words in tokens]
+            jobs = [(tokens[i], tokens[j], shingles[i], shingles[j], min_words, min_chars) for i, j in pairs]
+            pair_results = dict(zip(pairs, run_pair_jobs(jobs)))
 
-            for i in range(len(urls)):
-                for j in range(i + 1, len(urls)):
-                    sim_score = similarity_matrix[i][j]
-                    diff_html = highlight_diff(texts[i], texts[j])
-                    seq_matcher = difflib.SequenceMatcher(None, texts[i], texts[j])
-                    matching_blocks = seq_matcher.get_matching_blocks()
-                    matched_content = [texts[i][block.a:block.a + block.size] for block in matching_blocks if block.size > 30]
-                    matched_text = "\n\n".join([f"...{chunk.strip()}..." for chunk in matched_content if chunk.strip()])
-
-                    st.session_state['comparison_results'].append({
-                        "URL 1": urls[i],
-                        "URL 2": urls[j],
-                        "Similarity Score": round(sim_score, 4),
-                        "Highlighted Duplicate Phrases": matched_text,
-                        "Diff HTML": diff_html
-                    })
+            for i, j, sim_score in zip(iu[0], iu[1], scores):
+                # Pairs below the threshold keep their score but skip the diff work.
+                diff_html, matched_content = pair_results.get((i, j), (None, []))
+                matched_text = "\n\n".join([f"...{chunk.strip()}..." for chunk in matched_content if chunk.strip()])
+
+                st.session_state['comparison_results'].append({
+                    "URL 1": urls[i],
+                    "URL 2": urls[j],
+                    "Similarity Score": round(float(sim_score), 4),
+                    "Highlighted Duplicate Phrases": matched_text,
+                    "Diff HTML": diff_html
+                })
 
             st.success("✅ Content comparison complete. View the results in the Report Viewer tab.")
 
@@ -152,21 +348,24 @@ elif page == "📊 Report Viewer":
         st.header("📊 Comparison Report")
         for result in st.session_state['comparison_results']:
             with st.expander(f"{result['URL 1']} ↔ {result['URL 2']} (Score: {result['Similarity Score']})"):
-                st.markdown("### Highlighted Duplicate Phrases")
-                st.code(result['Highlighted Duplicate Phrases'], language='text')
-                st.markdown("### Side-by-Side Diff Viewer")
-                st.components.v1.html(result['Diff HTML'], height=500, scrolling=True)
-
-        export_df = pd.DataFrame([{
-            "URL 1": r["URL 1"],
-            "URL 2": r["URL 2"],
-            "Similarity Score": r["Similarity Score"],
-            "Highlighted Duplicate Phrases": r["Highlighted Duplicate Phrases"]
-        } for r in st.session_state['comparison_results']])
+                if result['Diff HTML'] is None:
+                    st.info("Similarity is below the threshold, so no duplicate phrases or diff were computed.")
+                else:
+                    st.markdown("### Highlighted Duplicate Phrases")
+                    st.code(result['Highlighted Duplicate Phrases'], language='text')
+                    st.markdown("### Side-by-Side Diff Viewer")
+                    st.components.v1.html(result['Diff HTML'], height=500, scrolling=True)
+
+        export_columns = ["URL 1", "URL 2", "Similarity Score", "Highlighted Duplicate Phrases"]
 
+        # constant_memory flushes each row as it is written instead of holding the sheet in memory.
         buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-            export_df.to_excel(writer, index=False, sheet_name='Duplicates')
+        workbook = xlsxwriter.Workbook(buffer, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Duplicates')
+        worksheet.write_row(0, 0, export_columns, workbook.add_format({'bold': True, 'border': 1}))
+        for row, r in enumerate(st.session_state['comparison_results'], start=1):
+            worksheet.write_row(row, 0, [r[column] for column in export_columns])
+        workbook.close()
         st.download_button(
             label="📥 Download Duplicates Excel Report",
             data=buffer.getvalue(),
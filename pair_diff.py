@@ -0,0 +1,79 @@
+import difflib
+from collections import defaultdict
+
+# --- Pair Comparison Helpers ---
+# Kept in its own module so process_pair can be pickled by reference for worker processes.
+def highlight_diff(tokens1, tokens2):
+    d = difflib.HtmlDiff(wrapcolumn=80)
+    html_table = d.make_table(tokens1, tokens2, context=True, numlines=2)
+    styled_html = f"""
+    <style>
+    table {{
+        width: 100%;
+        border-collapse: collapse;
+        font-family: Arial, sans-serif;
+        font-size: 14px;
+    }}
+    th, td {{
+        padding: 8px;
+        text-align: left;
+        border: 1px solid #ccc;
+        white-space: pre-wrap;
+        word-wrap: break-word;
+    }}
+    tr:nth-child(even) {{
+        background-color: #f9f9f9;
+    }}
+    .diff_add {{ background-color: #d4f7dc; }}
+    .diff_chg {{ background-color: #fff3cd; }}
+    .diff_sub {{ background-color: #f8d7da; }}
+    </style>
+    {html_table}
+    """
+    return styled_html
+
+SHINGLE_SIZE = 8
+
+def build_shingles(words, size=SHINGLE_SIZE):
+    # Every position is kept: a shingle's first occurrence is often a teaser or heading,
+    # not the alignment that gives the longest shared passage.
+    shingles = defaultdict(list)
+    for k in range(len(words) - size + 1):
+        shingles[hash(tuple(words[k:k + size]))].append(k)
+    return shingles
+
+def find_duplicate_passages(words1, words2, shingles1, shingles2, min_chars=50, size=SHINGLE_SIZE):
+    starts = sorted((a, h) for h in shingles1.keys() & shingles2.keys() for a in shingles1[h])
+    passages = []
+    end = 0
+    for a, h in starts:
+        if a < end:
+            continue
+        best = None
+        for b in shingles2[h]:
+            if words1[a:a + size] != words2[b:b + size]:
+                continue
+            start, left = a, b
+            while start > end and left > 0 and words1[start - 1] == words2[left - 1]:
+                start -= 1
+                left -= 1
+            stop, right = a + size, b + size
+            while stop < len(words1) and right < len(words2) and words1[stop] == words2[right]:
+                stop += 1
+                right += 1
+            if best is None or stop - start > best[1] - best[0]:
+                best = (start, stop)
+        if best is None:
+            continue
+        passage = " ".join(words1[best[0]:best[1]])
+        # Only an accepted passage consumes words1; a short run must not hide a later, longer match.
+        if len(passage) >= min_chars:
+            passages.append(passage)
+            end = best[1]
+    return passages
+
+def process_pair(job):
+    tokens1, tokens2, shingles1, shingles2, size, min_chars = job
+    diff_html = highlight_diff(tokens1, tokens2)
+    matched_content = find_duplicate_passages(tokens1, tokens2, shingles1, shingles2, min_chars=min_chars, size=size)
+    return diff_html, matched_content